@@ -5,17 +5,92 @@ Conversational chat interface with natural game selection
 
 import streamlit as st
 import os
+import re
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import httpx
+import requests
 from anthropic import Anthropic
 import voyageai
 from dotenv import load_dotenv
-from database import init_database, get_all_games, get_game_chunks
+from database import init_database, get_all_games, get_game_chunks, get_library_version, load_game_index_files, normalize_embeddings, search_chunk_ids
+
+try:
+    from rapidfuzz import fuzz, process as fuzzy
+except ImportError:
+    fuzzy = None  # rapidfuzz not installed, skip typo-tolerant game matching
+
+try:
+    import faiss
+except ImportError:
+    faiss = None  # faiss not installed, search with NumPy instead
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None  # simsimd not installed, score with NumPy instead
 
 # Load environment variables
 load_dotenv()
 
 # Configuration
 TOP_K_RESULTS = 5
+API_TIMEOUT = 30.0  # Seconds to wait on Claude/Voyage before giving up
+API_CONNECT_TIMEOUT = 5.0  # Seconds to establish a connection
+FAST_MODEL = "claude-haiku-4-5-20251001"  # Game detection and short chit-chat
+SMART_MODEL = "claude-sonnet-4-20250514"  # Rules answers and game intros
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Similarity above which a past answer is reused (same content words only)
+SEMANTIC_CACHE_MAX_ENTRIES = 500  # Per game, least recently used evicted first
+SEMANTIC_CACHE_TTL = 24 * 60 * 60  # Seconds before a cached answer goes stale
+INTRO_CACHE_TTL = 24 * 60 * 60  # Seconds before a game intro is regenerated
+GAME_CACHE_SIZE = 32  # Games whose search index and answer cache stay loaded (older library versions drop out)
+QUESTION_EMBEDDING_CACHE_SIZE = 4096  # Distinct questions whose embeddings are kept in memory
+FUZZY_MATCH_CUTOFF = 85  # Minimum rapidfuzz score to accept a misspelled title
+TITLE_MATCH_THRESHOLD = 0.6  # Minimum message/title similarity to pick a game without Claude
+TITLE_MATCH_MARGIN = 0.1  # ...and how far ahead of the runner-up it must be
+FAISS_HNSW_MIN_CHUNKS = 10000  # Switch from exact to approximate FAISS search above this
+FTS_PREFILTER_MIN_CHUNKS = 2000  # Games this big are keyword-filtered before the embedding search
+FTS_CANDIDATES = 50  # Chunks the keyword prefilter hands to the embedding search
+
+# Question/message patterns (compiled once; matched case-insensitively in one pass)
+SETUP_RE = re.compile(r"\b(set\s?up|start|beginning|prepare|how to play|getting started)", re.I)
+STAFF_OFFER_RE = re.compile(r"request staff assistance", re.I)
+SWITCH_RE = re.compile(r"\b(switch to|change to|let['’]?s play|we['’]?re playing|now playing|actually|instead)", re.I)
+
+# Words that can differ between two phrasings of the same question; anything
+# else ("red" vs "blue", "not", numbers) must match for a cached answer to be reused
+FILLER_WORDS = frozenset("""
+a an the is are was be do does did can could would should will i we you my our your me us
+to of in on at for with about from by and or if it its this that there what how when
+please tell explain know happens happen so just any some
+""".split())
+
+# How each document type is labelled in prompts, and in the chat when an answer mixes types
+SOURCE_LABELS = {
+    "rulebook": "Rulebook",
+    "faq": "FAQ",
+    "errata": "Errata",
+    "supplement": "Supplement",
+}
+SOURCE_BADGES = {
+    "rulebook": "📖 Rulebook",
+    "faq": "❓ FAQ",
+    "errata": "⚠️ Errata",
+    "supplement": "📑 Supplement",
+}
+
+# Nicknames customers use for games, mapped to library titles
+GAME_ALIASES = {
+    "settlers of catan": "Catan",
+    "settlers": "Catan",
+    "ttr": "Ticket To Ride",
+    "7 wonders": "7 Wonders Duel",
+    "seven wonders": "7 Wonders Duel",
+    "seven wonders duel": "7 Wonders Duel",
+}
 
 def send_staff_ping(table_id, game_title, question, reason="rules_question"):
     """
@@ -83,111 +158,422 @@ st.set_page_config(
 # Initialize clients
 @st.cache_resource
 def init_clients():
-    """Initialize API clients"""
-    anthropic_client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
-    voyage_client = voyageai.Client(api_key=os.environ.get("VOYAGE_API_KEY"))
+    """Initialize API clients over pooled keep-alive connections"""
+    # One pooled HTTP client for every Claude call, so TLS handshakes aren't repeated
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=60),
+        timeout=httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT)
+    )
+    anthropic_client = Anthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+        http_client=http_client,
+        max_retries=int(os.environ.get("ANTHROPIC_MAX_RETRIES", 2))
+    )
+    
+    # The Voyage SDK uses requests; its session hook lets all threads share one pool
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=20))
+    voyageai.requestssession = session
+    voyage_client = voyageai.Client(api_key=os.environ.get("VOYAGE_API_KEY"), timeout=API_TIMEOUT)
+    
     return anthropic_client, voyage_client
 
+@st.cache_resource
+def get_executor():
+    """Shared worker threads for overlapping independent API calls"""
+    return ThreadPoolExecutor(max_workers=4)
+
 # Load game library
-@st.cache_data
-def load_game_library():
-    """Load available games from database"""
+@st.cache_data(max_entries=1)
+def load_game_library(library_version):
+    """
+    Load available games from database
+    
+    Returns (games by title, sorted tuple of titles, bulleted markdown list of
+    titles). library_version is only part of the cache key, so games added by
+    process_rulebooks.py show up without restarting the app.
+    """
     init_database()
-    games = get_all_games()
-    return {game['title']: game for game in games}
+    games = {game['title']: game for game in get_all_games()}
+    game_titles = tuple(sorted(games))
+    game_list_markdown = "\n".join(f"• {title}" for title in game_titles)
+    return games, game_titles, game_list_markdown
+
+@st.cache_resource
+def build_game_matcher(game_titles):
+    """Build the alias lookup used to spot game names without calling Claude"""
+    alias_map = {title.lower(): title for title in game_titles}
+    for alias, title in GAME_ALIASES.items():
+        if title in alias_map.values():
+            alias_map.setdefault(alias, title)
+    
+    # Longest aliases first so "7 wonders duel" wins over "7 wonders"
+    aliases = sorted(alias_map, key=len, reverse=True)
+    alias_pattern = re.compile(r"\b(" + "|".join(map(re.escape, aliases)) + r")\b")
+    return alias_map, alias_pattern
+
+def fuzzy_match_game(text, alias_map):
+    """Match misspelled game names by comparing word windows against each alias"""
+    words = re.findall(r"[\w']+", text)
+    max_words = max(len(alias.split()) for alias in alias_map)
+    
+    best = None
+    for size in range(1, max_words + 1):
+        for start in range(len(words) - size + 1):
+            window = " ".join(words[start:start + size])
+            match = fuzzy.extractOne(window, alias_map.keys(), scorer=fuzz.ratio, score_cutoff=FUZZY_MATCH_CUTOFF)
+            if match and (best is None or match[1] > best[1]):
+                best = match
+    
+    return alias_map[best[0]] if best else None
+
+@st.cache_resource(show_spinner=False)
+def get_title_embeddings(game_titles):
+    """Normalized Voyage embeddings of the game titles, one row per title"""
+    _, voyage_client = init_clients()
+    result = voyage_client.embed(
+        texts=list(game_titles),
+        model="voyage-3",
+        input_type="document"
+    )
+    return normalize_embeddings(result.embeddings)
+
+def classify_game(question_embedding, game_titles):
+    """Pick the title closest to the message embedding, or None if it isn't a clear winner"""
+    scores = get_title_embeddings(tuple(game_titles)) @ question_embedding
+    ranked = np.argsort(-scores)
+    best = scores[ranked[0]]
+    runner_up = scores[ranked[1]] if len(ranked) > 1 else -1.0
+    
+    if best >= TITLE_MATCH_THRESHOLD and best - runner_up >= TITLE_MATCH_MARGIN:
+        return game_titles[ranked[0]]
+    return None
 
 # Detect which game the user is asking about
-def detect_game(message, available_games, anthropic_client):
-    """Use Claude to detect which game the user is referring to"""
+def detect_game(message, available_games, game_matcher, anthropic_client, question_future=None):
+    """
+    Detect which game the user is referring to, using Claude only as a last resort
+    
+    question_future, if given, resolves to the message's embedding (started in
+    the background by the caller) and is only waited on if the cheaper
+    matchers come up empty. Returns (game_title, reply). When Claude is asked and no game was mentioned,
+    the same call drafts the general reply, so those turns take one request
+    instead of two. reply is None whenever nothing was drafted.
+    """
+    alias_map, alias_pattern = game_matcher
+    text = message.lower()
+    
+    # Exact title or nickname mentioned
+    match = alias_pattern.search(text)
+    if match:
+        return alias_map[match.group(1)], None
+    
+    # Close misspelling of a title or nickname
+    if fuzzy is not None:
+        detected = fuzzy_match_game(text, alias_map)
+        if detected:
+            return detected, None
+    
+    # Message embedding close to exactly one title
+    if question_future is not None:
+        try:
+            question_embedding = question_future.result()
+        except Exception:
+            question_embedding = None  # Voyage is down, but Claude can still detect the game
+        
+        if question_embedding is not None:
+            try:
+                detected = classify_game(question_embedding, available_games)
+            except Exception:
+                detected = None  # Title embeddings need Voyage too; fall through to Claude
+            if detected:
+                return detected, None
+    
     game_list = ", ".join(available_games)
     
-    prompt = f"""The user is at a board game cafe. They just said: "{message}"
+    prompt = f"""You are a friendly board game rules assistant at The Merry Meeple cafe. The customer just said: "{message}"
 
 Available games: {game_list}
 
-Which game are they referring to? Respond with ONLY the exact game title from the list, or "NONE" if they haven't mentioned a specific game yet.
+Which game are they referring to? Respond with ONLY a JSON object with two keys:
+- "game": the exact game title from the list, or "NONE" if they haven't mentioned a specific game yet
+- "reply": if "game" is "NONE", a brief (1-2 sentence) natural, helpful response that invites them to tell you which game they're playing (mention the available games if they're asking about games); otherwise ""
 
 Examples:
-User: "We're playing Catan" → Catan
-User: "I need help with Wingspan setup" → Wingspan
-User: "How does Streets work?" → Streets
-User: "What games do you have?" → NONE
-User: "Can I get a coffee?" → NONE
+User: "We're playing Catan" → {{"game": "Catan", "reply": ""}}
+User: "I need help with Wingspan setup" → {{"game": "Wingspan", "reply": ""}}
+User: "How does Streets work?" → {{"game": "Streets", "reply": ""}}
+User: "Can I get a coffee?" → {{"game": "NONE", "reply": "I can't fetch coffee, but the counter staff can! Which game are you playing? I'm happy to help with the rules."}}
 
-Game title:"""
+JSON:"""
 
     response = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=50,
+        model=FAST_MODEL,
+        max_tokens=200,
         messages=[{"role": "user", "content": prompt}]
     )
     
-    detected = response.content[0].text.strip()
+    text = response.content[0].text.strip()
+    try:
+        result = json.loads(text[text.index("{"):text.rindex("}") + 1])
+        detected = str(result.get("game", "")).strip()
+        reply = str(result.get("reply", "")).strip() or None
+    except ValueError:
+        # Not JSON - treat the whole response as a bare title
+        detected, reply = text, None
     
     # Validate it's in our list
     if detected in available_games:
-        return detected
-    return None
+        return detected, None
+    return None, reply
 
 # Vector search
-def cosine_similarity(vec1, vec2):
-    """Calculate cosine similarity"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
-
-def search_chunks(query_embedding, chunks, top_k=TOP_K_RESULTS):
-    """Find most relevant chunks"""
-    similarities = []
-    for chunk in chunks:
-        sim = cosine_similarity(query_embedding, chunk["embedding"])
-        similarities.append((sim, chunk))
-    
-    similarities.sort(reverse=True, key=lambda x: x[0])
-    return [chunk for _, chunk in similarities[:top_k]]
-
-def answer_question(question, game_title, voyage_client, anthropic_client):
-    """Generate answer to rules question"""
-    
-    # Load game chunks from database
-    chunks = get_game_chunks(game_title)
-    
-    if not chunks:
-        return "Sorry, I couldn't find the rulebook for this game in my library.", []
-    
-    # Embed question
-    question_embedding = voyage_client.embed(
-        texts=[question],
+@st.cache_resource(max_entries=GAME_CACHE_SIZE, show_spinner=False)
+def get_game_index(game_title, library_version):
+    """
+    Load a game's chunks once as parallel arrays for fast search
+    
+    Returns None if the game has no chunks, else a dict of
+    - texts, pages, source_types: per-chunk lists, in row order
+    - row_positions: database chunk id -> row
+    - embeddings: contiguous (N, D) float32 matrix of normalized rows
+    - embeddings_i8: int8 copy of the embeddings (None if simsimd isn't installed,
+      or FAISS answers every search for this game)
+    - faiss: FAISS index over the embeddings (None if faiss isn't installed)
+    
+    library_version is only part of the cache key, so re-processing rulebooks
+    (which rewrites the database) loads fresh chunks on the next question.
+    """
+    # Fast path: memory-map the matrix written by process_rulebooks.py
+    index_files = load_game_index_files(game_title)
+    
+    if index_files:
+        chunks, embeddings = index_files
+    else:
+        chunks = get_game_chunks(game_title)
+        
+        if not chunks:
+            return None
+        
+        # Rows are stored as float16 but searched as float32, which BLAS can use.
+        # New rows are normalized at ingest; renormalize for rows stored before that
+        embeddings = normalize_embeddings(np.stack([chunk["embedding"] for chunk in chunks]))
+    
+    faiss_index = None
+    if faiss is not None:
+        # Inner product on unit vectors is cosine similarity
+        dimensions = embeddings.shape[1]
+        if len(chunks) >= FAISS_HNSW_MIN_CHUNKS:
+            faiss_index = faiss.IndexHNSWFlat(dimensions, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            faiss_index = faiss.IndexFlatIP(dimensions)
+        faiss_index.add(embeddings)
+    
+    # simsimd has an int8 cosine kernel; a quarter of the memory to scan per question.
+    # Only worth keeping when search_chunks will scan rows itself: without FAISS,
+    # or for games big enough that keyword_candidates hands it a subset of rows
+    needs_row_scan = faiss_index is None or len(chunks) >= FTS_PREFILTER_MIN_CHUNKS
+    embeddings_i8 = quantize(embeddings) if simsimd is not None and needs_row_scan else None
+    
+    return {
+        "texts": [chunk["text"] for chunk in chunks],
+        "pages": [chunk["page"] for chunk in chunks],
+        "source_types": [chunk.get("source_type", "rulebook") for chunk in chunks],
+        "row_positions": {chunk["id"]: i for i, chunk in enumerate(chunks)},
+        "embeddings": embeddings,
+        "embeddings_i8": embeddings_i8,
+        "faiss": faiss_index
+    }
+
+def normalize(vector):
+    """Return a unit-length float32 copy of an embedding"""
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+def quantize(vectors):
+    """Scale each row so its largest component is +/-127 and round to int8"""
+    vectors = np.atleast_2d(vectors)
+    scale = 127 / np.maximum(np.abs(vectors).max(axis=1, keepdims=True), 1e-12)
+    return np.round(vectors * scale).astype(np.int8)
+
+def keyword_candidates(question, game_title, index):
+    """Rows of a large game's chunks that share words with the question, or None to search every chunk"""
+    if len(index["texts"]) < FTS_PREFILTER_MIN_CHUNKS:
+        return None
+    
+    chunk_ids = search_chunk_ids(game_title, question, FTS_CANDIDATES) or []
+    rows = [index["row_positions"][i] for i in chunk_ids if i in index["row_positions"]]
+    
+    # Too few keyword hits (e.g. a paraphrased question) - rank everything instead
+    if len(rows) < TOP_K_RESULTS:
+        return None
+    return np.array(rows)
+
+def search_chunks(query_embedding, index, top_k=TOP_K_RESULTS, candidates=None):
+    """
+    Find most relevant chunks (query_embedding must be unit length)
+    
+    candidates, if given, is an array of rows to rank instead of every chunk.
+    """
+    if candidates is None and index["faiss"] is not None:
+        _, idx = index["faiss"].search(query_embedding[np.newaxis, :], top_k)
+        idx = idx[0][idx[0] >= 0]
+    else:
+        rows = slice(None) if candidates is None else candidates
+        if index["embeddings_i8"] is not None:
+            # Hand-tuned SIMD int8 kernel for the CPU we're running on
+            distances = simsimd.cdist(quantize(query_embedding), index["embeddings_i8"][rows], metric="cosine")
+            scores = 1 - np.asarray(distances)[0]
+        else:
+            # Both sides are normalized, so a dot product is the cosine similarity
+            scores = index["embeddings"][rows] @ query_embedding
+        
+        # O(N) partial selection of the top K, then sort only those K
+        k = min(top_k, scores.shape[0])
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        if candidates is not None:
+            idx = candidates[idx]
+    
+    # Only the winning rows are turned into chunk dicts
+    return [
+        {
+            "text": index["texts"][i],
+            "page": index["pages"][i],
+            "source_type": index["source_types"][i]
+        }
+        for i in map(int, idx)
+    ]
+
+# Semantic response cache
+class SemanticCache:
+    """
+    Reuses answers for questions that mean the same thing
+    
+    Stores unit-length question embeddings as rows of a matrix, so a lookup
+    is one matrix-vector product. A similar embedding alone isn't enough:
+    questions one word apart ("red power" vs "blue power") embed close
+    together but need different answers, so the cached question must also
+    have the same content words. Entries expire after `ttl` seconds and the
+    least recently used entry is replaced once `max_entries` is reached.
+    """
+    
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embeddings = None
+        self.keywords = []
+        self.answers = []
+        self.created = []
+        self.last_used = []
+        self.lock = threading.Lock()
+    
+    def lookup(self, query_embedding, keywords):
+        """Return a cached answer for a similar question with the same keywords, or None"""
+        with self.lock:
+            if self.embeddings is None:
+                return None
+            
+            sims = self.embeddings @ query_embedding
+            now = time.time()
+            
+            for i in map(int, np.flatnonzero(sims >= self.threshold)):
+                if self.keywords[i] == keywords and now - self.created[i] <= self.ttl:
+                    self.last_used[i] = now
+                    return self.answers[i]
+            return None
+    
+    def add(self, query_embedding, keywords, answer):
+        """Remember an answer, evicting a stale or least recently used entry if full"""
+        with self.lock:
+            now = time.time()
+            row = np.asarray(query_embedding, dtype=np.float32)
+            
+            if self.embeddings is None:
+                self.embeddings = row[np.newaxis, :]
+            elif len(self.answers) < self.max_entries:
+                self.embeddings = np.vstack([self.embeddings, row])
+            else:
+                # Full - overwrite an expired entry if there is one, else the LRU
+                expired = [i for i, t in enumerate(self.created) if now - t > self.ttl]
+                slot = expired[0] if expired else int(np.argmin(self.last_used))
+                self.embeddings[slot] = row
+                self.keywords[slot] = keywords
+                self.answers[slot] = answer
+                self.created[slot] = now
+                self.last_used[slot] = now
+                return
+            
+            self.keywords.append(keywords)
+            self.answers.append(answer)
+            self.created.append(now)
+            self.last_used.append(now)
+
+@st.cache_resource(max_entries=GAME_CACHE_SIZE)
+def get_semantic_cache(game_title, library_version):
+    """Shared answer cache for one game (lives for the whole server process)"""
+    return SemanticCache()
+
+def question_keywords(question):
+    """The words of a question that change its meaning, for SemanticCache"""
+    return frozenset(re.findall(r"[\w']+", question.lower())) - FILLER_WORDS
+
+def embed_question(question, voyage_client):
+    """Embed a customer question, normalized once so search is a plain dot product"""
+    # Case and surrounding whitespace don't change the meaning, so share one cache entry
+    return embed_question_text(" ".join(question.lower().split()), voyage_client)
+
+# Leading underscore tells Streamlit not to hash the client into the cache key
+@st.cache_resource(max_entries=QUESTION_EMBEDDING_CACHE_SIZE, show_spinner=False)
+def embed_question_text(text, _voyage_client):
+    """Embed already-normalized question text (cached, so the result is read-only)"""
+    embedding = normalize(_voyage_client.embed(
+        texts=[text],
         model="voyage-3",
         input_type="query"
-    ).embeddings[0]
+    ).embeddings[0])
+    embedding.setflags(write=False)  # Shared by every caller asking the same question
+    return embedding
+
+def answer_question(question, game_title, voyage_client, anthropic_client, question_embedding=None):
+    """
+    Answer a rules question, streaming it into the current chat message
     
-    # Find relevant chunks
-    top_chunks = search_chunks(question_embedding, chunks)
+    Pass question_embedding if it has already been computed.
+    Returns (answer, source_pages, sources_used) once the answer is complete.
+    """
     
-    # Build context
-    context_parts = []
-    sources_used = set()
-    for chunk in top_chunks:
-        page = chunk['page']
-        source_type = chunk.get('source_type', 'rulebook')
-        sources_used.add(source_type)
+    # Load game chunks and embedding matrix (cached per game)
+    library_version = get_library_version()
+    index = get_game_index(game_title, library_version)
+    
+    if index is None:
+        answer = "Sorry, I couldn't find the rulebook for this game in my library."
+        st.markdown(answer)
+        return answer, [], set()
+    
+    with st.spinner("Checking the rulebook..."):
+        # Embed question
+        if question_embedding is None:
+            question_embedding = embed_question(question, voyage_client)
         
-        # Add source label to context
-        source_label = {
-            'rulebook': 'Rulebook',
-            'faq': 'FAQ',
-            'errata': 'Errata',
-            'supplement': 'Supplement'
-        }.get(source_type, 'Rulebook')
+        # Reuse the answer to an earlier, equivalent question if we have one
+        semantic_cache = get_semantic_cache(game_title, library_version)
+        keywords = question_keywords(question)
+        cached = semantic_cache.lookup(question_embedding, keywords)
         
-        context_parts.append(f"[{source_label} - Page {page}]\n{chunk['text']}")
+        # Find relevant chunks
+        if not cached:
+            candidates = keyword_candidates(question, game_title, index)
+            top_chunks = search_chunks(question_embedding, index, candidates=candidates)
     
-    context = "\n\n---\n\n".join(context_parts)
+    if cached:
+        st.markdown(cached[0])
+        return cached
     
     # Detect if this is a setup question
-    setup_keywords = ["setup", "set up", "start", "beginning", "prepare", "how to play", "getting started"]
-    is_setup_question = any(keyword in question.lower() for keyword in setup_keywords)
+    is_setup_question = bool(SETUP_RE.search(question))
     
     # Build prompt based on question type
     if is_setup_question:
@@ -200,8 +586,8 @@ def answer_question(question, game_title, voyage_client, anthropic_client):
     else:
         instruction = """Provide a clear, direct answer to the specific question asked."""
     
-    # Generate answer
-    prompt = f"""You are a helpful board game rules assistant at The Merry Meeple cafe. Answer the customer's question based ONLY on the source documents provided below.
+    # Build the prompt in one pass: instructions, source excerpts, question
+    prompt_parts = [f"""You are a helpful board game rules assistant at The Merry Meeple cafe. Answer the customer's question based ONLY on the source documents provided below.
 
 The sources may include:
 - Rulebook (official game rules)
@@ -224,37 +610,75 @@ Rules for answering:
 - NEVER say you've notified staff unless the customer clicked the actual button
 
 SOURCE DOCUMENTS FOR {game_title.upper()}:
-{context}
+"""]
+    
+    sources_used = set()
+    for i, chunk in enumerate(top_chunks):
+        page = chunk['page']
+        source_type = chunk.get('source_type', 'rulebook')
+        sources_used.add(source_type)
+        
+        # Add source label to context
+        source_label = SOURCE_LABELS.get(source_type, 'Rulebook')
+        
+        if i:
+            prompt_parts.append("\n\n---\n\n")
+        prompt_parts.append(f"[{source_label} - Page {page}]\n{chunk['text']}")
+    
+    prompt_parts.append(f"""
 
 CUSTOMER QUESTION: {question}
 
-YOUR ANSWER:"""
+YOUR ANSWER:""")
+    prompt = "".join(prompt_parts)
 
-    message = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
+    # Stream tokens to the page as they arrive instead of waiting for the full answer
+    with anthropic_client.messages.stream(
+        model=SMART_MODEL,
         max_tokens=1200,  # Increased for detailed setup instructions
         messages=[{"role": "user", "content": prompt}]
-    )
+    ) as stream:
+        answer = st.write_stream(stream.text_stream)
     
-    answer = message.content[0].text
     source_pages = sorted(set([chunk['page'] for chunk in top_chunks]))
     
+    semantic_cache.add(question_embedding, keywords, (answer, source_pages, sources_used))
+    
     # Return metadata about sources used
     return answer, source_pages, sources_used
 
+@st.cache_resource
+def get_intro_cache():
+    """Welcome messages already generated: game_title -> (message, created, library_version)"""
+    return {}
+
 def generate_game_intro(game_title, voyage_client, anthropic_client):
-    """Generate a brief intro about the game from rulebook"""
+    """
+    Stream a brief intro about the game from the rulebook into the current chat message
     
-    # Load game chunks from database
-    chunks = get_game_chunks(game_title)
+    The prompt only depends on the game, so an intro generated for one customer
+    is reused for everyone who picks the same game within INTRO_CACHE_TTL.
+    """
+    library_version = get_library_version()
+    intro_cache = get_intro_cache()
     
-    if not chunks:
-        return f"Great! Let's dive into **{game_title}**. What would you like to know?"
+    # One entry per game, replaced when the game's rulebook is re-processed
+    cached = intro_cache.get(game_title)
+    if cached and cached[2] == library_version and time.time() - cached[1] < INTRO_CACHE_TTL:
+        st.markdown(cached[0])
+        return cached[0]
+    
+    # Load game chunks (cached per game)
+    with st.spinner("Loading game info..."):
+        index = get_game_index(game_title, library_version)
+    
+    if index is None:
+        intro_message = f"Great! Let's dive into **{game_title}**. What would you like to know?"
+        st.markdown(intro_message)
+        return intro_message
     
     # Get first few chunks (usually contain overview/intro)
-    intro_chunks = chunks[:5]
-    context_parts = [chunk['text'] for chunk in intro_chunks]
-    context = "\n\n".join(context_parts)
+    context = "\n\n".join(index["texts"][:5])
     
     # Generate intro
     prompt = f"""Based on the rulebook intro below, give a warm, brief 2-3 sentence welcome message about {game_title}. Mention:
@@ -269,19 +693,22 @@ RULEBOOK INTRO:
 
 Your welcome message:"""
 
-    message = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=200,
-        messages=[{"role": "user", "content": prompt}]
-    )
-    
-    intro = message.content[0].text
-    return f"Got it! I'm here to help with **{game_title}**.\n\n{intro}\n\nWhat would you like to know?"
-
-def generate_general_response(message, available_games, anthropic_client):
-    """Generate response when no game is selected"""
-    game_list = "\n".join([f"• {game}" for game in sorted(available_games)])
-    
+    def intro_stream():
+        yield f"Got it! I'm here to help with **{game_title}**.\n\n"
+        with anthropic_client.messages.stream(
+            model=SMART_MODEL,
+            max_tokens=200,
+            messages=[{"role": "user", "content": prompt}]
+        ) as stream:
+            yield from stream.text_stream
+        yield "\n\nWhat would you like to know?"
+    
+    intro_message = st.write_stream(intro_stream())
+    intro_cache[game_title] = (intro_message, time.time(), library_version)
+    return intro_message
+
+def generate_general_response(message, game_list, anthropic_client):
+    """Stream a response when no game is selected into the current chat message (game_list is a bulleted markdown list)"""
     prompt = f"""You are a friendly board game rules assistant at The Merry Meeple cafe. The customer just said: "{message}"
 
 They haven't selected a game yet. Respond naturally and helpfully. If they're asking about games, mention we have these available:
@@ -291,32 +718,41 @@ Keep your response brief (1-2 sentences) and invite them to tell you which game
 
 Your response:"""
 
-    response = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
+    with anthropic_client.messages.stream(
+        model=FAST_MODEL,
         max_tokens=150,
         messages=[{"role": "user", "content": prompt}]
-    )
+    ) as stream:
+        return st.write_stream(stream.text_stream)
+
+def answer_turn(prompt, game_title, voyage_client, anthropic_client, question_embedding=None):
+    """Answer a rules question in the chat and record it in the history"""
+    with st.chat_message("assistant"):
+        answer, pages, sources_used = answer_question(
+            prompt,
+            game_title,
+            voyage_client,
+            anthropic_client,
+            question_embedding=question_embedding
+        )
+        
+        if pages:
+            st.caption(f"📄 Pages: {', '.join(map(str, pages))}")
+        
+        # Show source types if multiple document types were used
+        if len(sources_used) > 1:
+            source_str = ' + '.join([SOURCE_BADGES.get(s, s.title()) for s in sorted(sources_used)])
+            st.caption(f"📚 Sources: {source_str}")
     
-    return response.content[0].text
-    """Generate response when no game is selected"""
-    game_list = "\n".join([f"• {game}" for game in sorted(available_games)])
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": answer,
+        "pages": pages
+    })
     
-    prompt = f"""You are a friendly board game rules assistant at The Merry Meeple cafe. The customer just said: "{message}"
-
-They haven't selected a game yet. Respond naturally and helpfully. If they're asking about games, mention we have these available:
-{game_list}
-
-Keep your response brief (1-2 sentences) and invite them to tell you which game they're playing.
-
-Your response:"""
-
-    response = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=150,
-        messages=[{"role": "user", "content": prompt}]
-    )
-    
-    return response.content[0].text
+    # If answer offers staff assistance, rerun to show buttons immediately
+    if STAFF_OFFER_RE.search(answer):
+        st.rerun()
 
 # Main app
 def main():
@@ -326,7 +762,7 @@ def main():
     
     # Initialize
     anthropic_client, voyage_client = init_clients()
-    game_library = load_game_library()
+    game_library, game_titles, game_list_markdown = load_game_library(get_library_version())
     
     # Check if library is empty
     if not game_library:
@@ -339,8 +775,6 @@ def main():
         st.session_state.messages = []
     if 'current_game' not in st.session_state:
         st.session_state.current_game = None
-    if 'pending_staff_request' not in st.session_state:
-        st.session_state.pending_staff_request = None
     if 'last_question' not in st.session_state:
         st.session_state.last_question = None
     
@@ -356,7 +790,7 @@ def main():
                 st.caption(f"📄 Pages: {', '.join(map(str, message['pages']))}")
             
             # Check if this message offers staff assistance
-            if message["role"] == "assistant" and "request staff assistance" in message["content"].lower():
+            if message["role"] == "assistant" and STAFF_OFFER_RE.search(message["content"]):
                 # Show staff request button only if not already requested for this message
                 if message.get("staff_requested") != True:
                     col1, col2, col3 = st.columns([1, 1, 3])
@@ -404,14 +838,24 @@ def main():
             st.markdown(prompt)
         
         # Check if user wants to switch games
-        switch_phrases = ["switch to", "change to", "let's play", "we're playing", "now playing", "actually", "instead"]
-        is_switching_game = any(phrase in prompt.lower() for phrase in switch_phrases)
+        is_switching_game = bool(SWITCH_RE.search(prompt))
         
         # Only detect game if: no current game OR user is explicitly switching
         should_detect_game = (st.session_state.current_game is None) or is_switching_game
         
         if should_detect_game:
-            detected_game = detect_game(prompt, list(game_library.keys()), anthropic_client)
+            # Embed the message in the background while we work out which game it
+            # is; detection can match it against the titles, and if a game is
+            # already selected the question may still be about it
+            question_future = get_executor().submit(embed_question, prompt, voyage_client)
+            
+            detected_game, general_reply = detect_game(
+                prompt,
+                game_titles,
+                build_game_matcher(game_titles),
+                anthropic_client,
+                question_future=question_future
+            )
             
             if detected_game and detected_game != st.session_state.current_game:
                 # Game detected and it's different - switch to it
@@ -419,59 +863,42 @@ def main():
                 
                 # Generate game intro
                 with st.chat_message("assistant"):
-                    with st.spinner("Loading game info..."):
-                        intro_message = generate_game_intro(
-                            detected_game,
-                            voyage_client,
-                            anthropic_client
-                        )
-                    st.markdown(intro_message)
+                    intro_message = generate_game_intro(
+                        detected_game,
+                        voyage_client,
+                        anthropic_client
+                    )
                 
                 st.session_state.messages.append({"role": "assistant", "content": intro_message})
                 st.rerun()
             
             elif detected_game and detected_game == st.session_state.current_game:
                 # Same game detected - just answer the question
-                with st.chat_message("assistant"):
-                    with st.spinner("Checking the rulebook..."):
-                        answer, pages, sources_used = answer_question(
-                            prompt,
-                            st.session_state.current_game,
-                            voyage_client,
-                            anthropic_client
-                        )
-                    # Store metadata for display
-                    st.session_state.last_answer_meta = {'sources_used': sources_used}
-                    
-                    st.markdown(answer)
-                    if pages:
-                        st.caption(f"📄 Pages: {', '.join(map(str, pages))}")
-                    
-                    # Show source types if multiple document types were used
-                    if len(sources_used) > 1:
-                        source_labels = {'rulebook': '📖 Rulebook', 'faq': '❓ FAQ', 'errata': '⚠️ Errata', 'supplement': '📑 Supplement'}
-                        source_str = ' + '.join([source_labels.get(s, s.title()) for s in sorted(sources_used)])
-                        st.caption(f"📚 Sources: {source_str}")
+                try:
+                    question_embedding = question_future.result()
+                except Exception:
+                    question_embedding = None  # answer_question embeds it again itself
                 
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": answer,
-                    "pages": pages
-                })
-                
-                # If answer offers staff assistance, rerun to show buttons immediately
-                if "request staff assistance" in answer.lower():
-                    st.rerun()
+                answer_turn(
+                    prompt,
+                    st.session_state.current_game,
+                    voyage_client,
+                    anthropic_client,
+                    question_embedding=question_embedding
+                )
             
             else:
-                # No game detected - general response
+                # No game detected - general response (already drafted if Claude was asked)
                 with st.chat_message("assistant"):
-                    response = generate_general_response(
-                        prompt,
-                        list(game_library.keys()),
-                        anthropic_client
-                    )
-                    st.markdown(response)
+                    if general_reply:
+                        response = general_reply
+                        st.markdown(response)
+                    else:
+                        response = generate_general_response(
+                            prompt,
+                            game_list_markdown,
+                            anthropic_client
+                        )
                 
                 st.session_state.messages.append({
                     "role": "assistant",
@@ -480,36 +907,12 @@ def main():
         
         else:
             # Game already selected and user isn't switching - answer about current game
-            with st.chat_message("assistant"):
-                with st.spinner("Checking the rulebook..."):
-                    answer, pages, sources_used = answer_question(
-                        prompt,
-                        st.session_state.current_game,
-                        voyage_client,
-                        anthropic_client
-                    )
-                # Store metadata for display
-                st.session_state.last_answer_meta = {'sources_used': sources_used}
-                
-                st.markdown(answer)
-                if pages:
-                    st.caption(f"📄 Pages: {', '.join(map(str, pages))}")
-                
-                # Show source types if multiple document types were used
-                if len(sources_used) > 1:
-                    source_labels = {'rulebook': '📖 Rulebook', 'faq': '❓ FAQ', 'errata': '⚠️ Errata', 'supplement': '📑 Supplement'}
-                    source_str = ' + '.join([source_labels.get(s, s.title()) for s in sorted(sources_used)])
-                    st.caption(f"📚 Sources: {source_str}")
-            
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": answer,
-                "pages": pages
-            })
-            
-            # If answer offers staff assistance, rerun to show buttons immediately
-            if "request staff assistance" in answer.lower():
-                st.rerun()
+            answer_turn(
+                prompt,
+                st.session_state.current_game,
+                voyage_client,
+                anthropic_client
+            )
     
     # Footer
     st.markdown("---")
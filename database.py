@@ -6,12 +6,75 @@ Stores processed rulebooks in SQLite
 import sqlite3
 import json
 import os
+import re
+import hashlib
+import threading
+import numpy as np
 
 DB_PATH = "game_library.db"
+INDEX_FOLDER = "data"  # Precomputed per-game search files (rebuilt from the database)
+EMBEDDING_CACHE_PATH = ".embedding_cache.db"  # Local cache of Voyage document embeddings (not deployed)
+EMBEDDING_DTYPE = np.float16  # Storage precision for chunk embeddings (plenty for cosine ranking)
+SCHEMA_VERSION = 3  # Bumped when stored data needs rewriting (tracked in PRAGMA user_version)
+MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the database file SQLite may memory-map
+
+# One connection per thread, reused across calls (sqlite3 connections aren't thread-safe)
+thread_state = threading.local()
+
+def get_connection():
+    """This thread's database connection, opened on first use"""
+    conn = getattr(thread_state, "conn", None)
+    if conn is not None and thread_state.path == DB_PATH:
+        return conn
+    
+    if conn is not None:
+        conn.close()  # DB_PATH was changed, so don't keep the old file open
+    
+    # The journal mode is left to process_rulebooks.py (see enable_write_ahead_log),
+    # so the app's read-only connections never create -wal/-shm files
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    
+    thread_state.conn = conn
+    thread_state.path = DB_PATH
+    return conn
+
+def close_connection():
+    """Fold the write-ahead log back into the database file and close this thread's connection"""
+    conn = getattr(thread_state, "conn", None)
+    if conn is None:
+        return
+    
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.OperationalError:
+        pass
+    conn.close()
+    thread_state.conn = None
+
+def enable_write_ahead_log():
+    """
+    Switch the database file to write-ahead logging, so the app can keep
+    reading while process_rulebooks.py writes (the mode sticks until disabled)
+    """
+    get_connection().execute("PRAGMA journal_mode=WAL")
+
+def disable_write_ahead_log():
+    """Fold the write-ahead log back in and return to a single self-contained database file"""
+    conn = getattr(thread_state, "conn", None)
+    if conn is None:
+        return
+    
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode=DELETE")
+    except sqlite3.OperationalError:
+        pass  # Another connection is still open - the file stays in WAL mode until the next run
 
 def init_database():
     """Initialize database schema"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Games table
@@ -52,43 +115,252 @@ def init_database():
         )
     """)
     
-    # Create index for faster lookups
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_game_id ON chunks(game_id)
-    """)
+    conn.commit()
+    
+    try:
+        migrate_database(conn)
+    except sqlite3.OperationalError:
+        # Read-only deployment - legacy rows still decode, just more slowly
+        conn.rollback()
+
+def migrate_database(conn):
+    """Bring stored data up to SCHEMA_VERSION (runs once per database file)"""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA user_version")
+    version = cursor.fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    
+    # Version 1: embeddings saved as JSON text become binary BLOBs
+    rows = []
+    if version < 1:
+        cursor.execute("SELECT id, embedding FROM chunks WHERE typeof(embedding) = 'text'")
+        rows = cursor.fetchall()
+        for row_id, value in rows:
+            embedding = normalize_embeddings(decode_embedding(value))
+            cursor.execute("UPDATE chunks SET embedding = ? WHERE id = ?", (encode_embedding(embedding), row_id))
+    
+    # Version 2: one index serves both the game lookup and the chunk ordering
+    if version < 2:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_game_chunk ON chunks(game_id, chunk_id)")
+        cursor.execute("DROP INDEX IF EXISTS idx_game_id")
+    
+    # Version 3: full-text index over chunk text, kept in sync by triggers
+    if version < 3:
+        try:
+            cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='id')")
+        except sqlite3.OperationalError:
+            pass  # SQLite built without FTS5 - search just skips the keyword prefilter
+        else:
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+                END
+            """)
+            cursor.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
     
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
+    
+    if rows:
+        cursor.execute("VACUUM")  # Hand the space the JSON text used back to the file
+        print(f"  ✅ Converted {len(rows)} embeddings to binary storage")
+
+def normalize_embeddings(embeddings):
+    """Scale float32 embedding rows to unit length (all-zero rows stay zero instead of NaN)"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def encode_embedding(embedding):
+    """Serialize an embedding to a compact binary BLOB"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+def decode_embedding(value):
+    """Deserialize an embedding BLOB (or a legacy JSON string) to float32"""
+    if isinstance(value, str):
+        return np.asarray(json.loads(value), dtype=np.float32)
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPE).astype(np.float32)
+
+# Embedding cache (kept in its own file so the library database stays lean)
+def embedding_cache_key(model, input_type, text):
+    """Cache key for a text embedded with a given model and input type ("document" or "query")"""
+    return f"{model}::{input_type}::{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+def get_cached_embeddings(keys):
+    """Look up embeddings by cache key; returns {key: float32 array} for the hits"""
+    if not keys:
+        return {}
+    
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)")
+        hits = {}
+        # Stay under SQLite's limit on query parameters
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ", ".join("?" * len(batch))
+            rows = conn.execute(f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", batch)
+            hits.update((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+        return hits
+    finally:
+        conn.close()
+
+def cache_embeddings(embeddings_by_key):
+    """Save embeddings (full float32 precision) under their cache keys"""
+    if not embeddings_by_key:
+        return
+    
+    conn = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB NOT NULL)")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)",
+                [(key, np.asarray(embedding, dtype=np.float32).tobytes()) for key, embedding in embeddings_by_key.items()]
+            )
+    finally:
+        conn.close()
+
+def get_index_paths(title):
+    """Paths of a game's precomputed embedding matrix (.npy) and chunk metadata (.jsonl)"""
+    slug = re.sub(r"[^a-z0-9]+", "_", title.lower()).strip("_")
+    return (
+        os.path.join(INDEX_FOLDER, f"{slug}.embeddings.npy"),
+        os.path.join(INDEX_FOLDER, f"{slug}.chunks.jsonl")
+    )
+
+def get_game_stamp(title):
+    """(processed_date, total_chunks) for a game - changes whenever its chunks do"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT processed_date, total_chunks FROM games WHERE title = ?", (title,))
+    result = cursor.fetchone()
+    return list(result) if result else None
+
+def save_game_index_files(title):
+    """
+    Write a game's search files from the database
+    
+    The .npy holds the normalized float32 embedding matrix. The .jsonl starts
+    with a header line stamping the game's processed_date and chunk count,
+    followed by one line of metadata per matrix row, in the same order.
+    SQLite stays the source of truth; these files just let the app
+    memory-map the matrix at startup.
+    """
+    chunks = get_game_chunks(title)
+    if not chunks:
+        return False
+    
+    matrix = normalize_embeddings(np.stack([chunk['embedding'] for chunk in chunks]))
+    
+    matrix_path, meta_path = get_index_paths(title)
+    os.makedirs(INDEX_FOLDER, exist_ok=True)
+    np.save(matrix_path, matrix)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"title": title, "stamp": get_game_stamp(title)}) + "\n")
+        for chunk in chunks:
+            f.write(json.dumps({
+                "id": chunk['id'],
+                "chunk_id": chunk['chunk_id'],
+                "page": chunk['page'],
+                "text": chunk['text'],
+                "source_type": chunk['source_type']
+            }) + "\n")
+    
+    return True
+
+def load_game_index_files(title):
+    """
+    Load a game's search files as (chunks, matrix), memory-mapping the matrix
+    
+    Returns None if the files are missing, were written before the game's
+    chunks last changed in the database, or predate the current file format.
+    """
+    matrix_path, meta_path = get_index_paths(title)
+    
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("stamp") != get_game_stamp(title):
+                return None
+            chunks = [json.loads(line) for line in f]
+        matrix = np.load(matrix_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    
+    if len(chunks) != matrix.shape[0]:
+        return None
+    
+    if chunks and "id" not in chunks[0]:
+        return None  # Written before chunk row ids were saved
+    
+    return chunks, matrix
+
+def get_library_version():
+    """
+    Version stamp for the library (changes whenever a game is added or re-processed)
+    
+    Read from the games table rather than the file's modification time, which
+    SQLite's -wal/-shm files coming and going would change without any new data.
+    """
+    conn = get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*), MAX(processed_date), SUM(total_chunks) FROM games").fetchone()
+    except sqlite3.OperationalError:
+        return None  # No games table yet
 
 def game_exists(title):
     """Check if game is already in database"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM games WHERE title = ?", (title,))
     result = cursor.fetchone()
-    conn.close()
     return result is not None
 
+def get_processed_filenames():
+    """Set of every PDF filename already processed, fetched in one query"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT filename FROM processed_files")
+    return {row[0] for row in cursor.fetchall()}
+
 def file_already_processed(filename):
     """Check if a specific PDF file has already been processed"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM processed_files WHERE filename = ?", (filename,))
     result = cursor.fetchone()
-    conn.close()
     return result is not None
 
-def add_game(title, filename, total_pages, chunks_with_embeddings, source_type='rulebook'):
+def add_game(title, filename, total_pages, chunks_with_embeddings, source_type='rulebook', embeddings=None):
     """
     Add a new game or add chunks to existing game
     
     If game exists: adds chunks to existing game
     If game doesn't exist: creates new game entry
+    
+    embeddings is an optional (N, D) matrix whose rows belong to the chunks in
+    order; without it each chunk must carry its own 'embedding'.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
+        # Take the write lock up front so the totals read below can't go stale
+        cursor.execute("BEGIN IMMEDIATE")
+        
         # Check if game already exists
         cursor.execute("SELECT id, total_pages, total_chunks FROM games WHERE title = ?", (title,))
         existing = cursor.fetchone()
@@ -120,15 +392,21 @@ def add_game(title, filename, total_pages, chunks_with_embeddings, source_type='
             game_id = cursor.lastrowid
             print(f"  ✅ Created new game entry")
         
-        # Insert chunks with source type
-        for chunk in chunks_with_embeddings:
-            # Serialize embedding as JSON
-            embedding_json = json.dumps(chunk['embedding'])
-            
-            cursor.execute("""
-                INSERT INTO chunks (game_id, chunk_id, page_number, text, embedding, source_type)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (game_id, chunk['chunk_id'], chunk['page'], chunk['text'], embedding_json, source_type))
+        # Store unit-length embeddings so search is a plain dot product
+        if embeddings is None:
+            embeddings = [chunk['embedding'] for chunk in chunks_with_embeddings]
+        embeddings = normalize_embeddings(embeddings)
+        
+        # Insert chunks with source type, as one bulk statement
+        rows = [
+            (game_id, chunk['chunk_id'], chunk['page'], chunk['text'], encode_embedding(embedding), source_type)
+            for chunk, embedding in zip(chunks_with_embeddings, embeddings)
+        ]
+        
+        cursor.executemany("""
+            INSERT INTO chunks (game_id, chunk_id, page_number, text, embedding, source_type)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
         
         # Record this file as processed
         cursor.execute("""
@@ -137,17 +415,18 @@ def add_game(title, filename, total_pages, chunks_with_embeddings, source_type='
         """, (filename, game_id, source_type))
         
         conn.commit()
-        return game_id
     
     except Exception as e:
         conn.rollback()
         raise e
-    finally:
-        conn.close()
+    
+    # Keep the memory-mapped search files in step with the database
+    save_game_index_files(title)
+    return game_id
 
 def get_all_games():
     """Get list of all games in library"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, title, total_pages, total_chunks, processed_date 
@@ -155,7 +434,6 @@ def get_all_games():
         ORDER BY title
     """)
     games = cursor.fetchall()
-    conn.close()
     
     return [
         {
@@ -170,7 +448,7 @@ def get_all_games():
 
 def get_game_chunks(game_title):
     """Get all chunks for a specific game"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     # Get game ID
@@ -178,36 +456,75 @@ def get_game_chunks(game_title):
     game = cursor.fetchone()
     
     if not game:
-        conn.close()
         return None
     
     game_id = game[0]
     
     # Get chunks with source type
     cursor.execute("""
-        SELECT chunk_id, page_number, text, embedding, source_type
+        SELECT chunk_id, page_number, text, embedding, source_type, id
         FROM chunks
         WHERE game_id = ?
         ORDER BY chunk_id
     """, (game_id,))
     
     chunks = cursor.fetchall()
-    conn.close()
+    if not chunks:
+        return []
+    
+    # Decode every embedding straight into one contiguous float32 matrix;
+    # each chunk's "embedding" is a row view into it
+    embeddings = np.empty((len(chunks), len(decode_embedding(chunks[0][3]))), dtype=np.float32)
+    for i, c in enumerate(chunks):
+        if isinstance(c[3], str):
+            embeddings[i] = decode_embedding(c[3])
+        else:
+            embeddings[i] = np.frombuffer(c[3], dtype=EMBEDDING_DTYPE)
     
     return [
         {
             "chunk_id": c[0],
             "page": c[1],
             "text": c[2],
-            "embedding": json.loads(c[3]),
-            "source_type": c[4] if len(c) > 4 else "rulebook"  # Backward compatibility
+            "embedding": embeddings[i],
+            "source_type": c[4] if len(c) > 4 else "rulebook",  # Backward compatibility
+            "id": c[5]
         }
-        for c in chunks
+        for i, c in enumerate(chunks)
     ]
 
+def search_chunk_ids(game_title, query, limit):
+    """
+    Row ids of a game's chunks that best match the query's words (BM25), best first
+    
+    Returns None if the database has no full-text index.
+    """
+    # Quote every word so punctuation in the question can't be read as FTS syntax
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return []
+    match = " OR ".join(f'"{word}"' for word in words)
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT chunks.id
+            FROM chunks_fts
+            JOIN chunks ON chunks.id = chunks_fts.rowid
+            JOIN games ON games.id = chunks.game_id
+            WHERE chunks_fts MATCH ? AND games.title = ?
+            ORDER BY chunks_fts.rank
+            LIMIT ?
+        """, (match, game_title, limit))
+    except sqlite3.OperationalError:
+        return None
+    
+    return [row[0] for row in cursor.fetchall()]
+
 def delete_game(title):
     """Remove a game and all its chunks from database"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -225,19 +542,21 @@ def delete_game(title):
             cursor.execute("DELETE FROM games WHERE id = ?", (game_id,))
             
             conn.commit()
-            return True
-        
-        return False
+        else:
+            return False
     
     except Exception as e:
         conn.rollback()
         raise e
-    finally:
-        conn.close()
+    
+    for path in get_index_paths(title):
+        if os.path.exists(path):
+            os.remove(path)
+    return True
 
 def get_library_stats():
     """Get statistics about the game library"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT COUNT(*) FROM games")
@@ -249,8 +568,6 @@ def get_library_stats():
     cursor.execute("SELECT SUM(total_chunks) FROM games")
     total_chunks = cursor.fetchone()[0] or 0
     
-    conn.close()
-    
     return {
         "total_games": total_games,
         "total_pages": total_pages,
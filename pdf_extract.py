@@ -0,0 +1,114 @@
+"""
+PDF text extraction (optionally spread across CPU cores) and token chunking
+Shared by process_rulebooks.py, rulebook_assistant.py and rulebook_assistant_simple.py
+"""
+
+import os
+import io
+import re
+from pypdf import PdfReader
+
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None  # PyMuPDF not installed, extract text with pypdf instead
+
+# Configuration
+CHUNK_SIZE = 500  # Tokens per chunk
+CHUNK_OVERLAP = 50  # Tokens shared by neighbouring chunks on a page
+MIN_CHUNK_TOKENS = 32  # Shorter page tails are folded into the chunk before them
+PARALLEL_EXTRACT_MIN_PAGES = 4  # Smaller PDFs aren't worth starting worker processes for
+MIN_CHUNK_CHARS = 20  # Chunks with fewer non-whitespace characters aren't embedded
+
+def count_pages(pdf_bytes):
+    """Number of pages in an in-memory PDF"""
+    if pymupdf is not None:
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return doc.page_count
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+def extract_page_range(pdf_bytes, start, stop):
+    """Extract text from pages [start, stop) of an in-memory PDF (runs in a worker process)"""
+    if pymupdf is not None:
+        # MuPDF's native text extraction is much faster than pypdf's pure-Python parser
+        with pymupdf.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return [doc[i].get_text("text") for i in range(start, stop)]
+    
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    return [reader.pages[i].extract_text() for i in range(start, stop)]
+
+def extract_text_from_pdf(pdf_bytes, pool=None):
+    """
+    Extract text from an in-memory PDF with page numbers
+    
+    `pool`, if given, is a ProcessPoolExecutor (shared by every PDF being
+    extracted) to spread the pages across. Without one the pages are read in
+    this process; the Streamlit apps extract this way, since forking workers
+    from a multithreaded server isn't safe.
+    """
+    total_pages = count_pages(pdf_bytes)
+    workers = min(os.cpu_count() or 1, total_pages)
+    
+    if pool is None or total_pages < PARALLEL_EXTRACT_MIN_PAGES or workers < 2:
+        texts = extract_page_range(pdf_bytes, 0, total_pages)
+    else:
+        # One contiguous range per worker, so each parses the PDF structure once
+        step = -(-total_pages // workers)
+        starts = list(range(0, total_pages, step))
+        stops = [min(start + step, total_pages) for start in starts]
+        parts = pool.map(extract_page_range, [pdf_bytes] * len(starts), starts, stops)
+        texts = [text for part in parts for text in part]
+    
+    return [{"page": i, "text": text} for i, text in enumerate(texts, start=1)]
+
+def is_meaningful_chunk(text):
+    """False for chunks that are just page numbers, whitespace or a stray word or two"""
+    if re.fullmatch(r"[\d\W_]*", text):
+        return False
+    return len(re.sub(r"\s", "", text)) >= MIN_CHUNK_CHARS
+
+def chunk_text(pages, encoding, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, min_page_tokens=1):
+    """
+    Chunk page text into overlapping token windows
+    
+    Pages with fewer than `min_page_tokens` tokens are skipped. Returns a list
+    of {"text", "page", "chunk_id"} dicts, leaving out chunks that aren't
+    meaningful (see is_meaningful_chunk).
+    """
+    chunks = []
+    
+    # Tokenize every page at once on tiktoken's native threads (rulebook
+    # text has no special tokens, so the ordinary encoder is enough)
+    page_tokens = encoding.encode_ordinary_batch([page_data["text"] for page_data in pages], num_threads=os.cpu_count() or 1)
+    
+    # Cut every page into overlapping token windows, then decode them all in one batch
+    step = chunk_size - overlap
+    windows = []
+    window_pages = []
+    for page_data, tokens in zip(pages, page_tokens):
+        if not tokens or len(tokens) < min_page_tokens:
+            continue
+        
+        # Windows starting at or before max_start leave a tail of at least
+        # MIN_CHUNK_TOKENS; the first one after it runs to the end of the page
+        max_start = len(tokens) - chunk_size - MIN_CHUNK_TOKENS
+        count = 1 if max_start < 0 else max_start // step + 2
+        starts = range(0, count * step, step)
+        
+        windows.extend(tokens[start:start + chunk_size] for start in starts[:-1])
+        windows.append(tokens[starts[-1]:])
+        window_pages.extend([page_data["page"]] * count)
+    
+    chunk_texts = encoding.decode_batch(windows, num_threads=os.cpu_count() or 1)
+    
+    for page_num, chunk_text in zip(window_pages, chunk_texts):
+        if not is_meaningful_chunk(chunk_text):
+            continue
+        
+        chunks.append({
+            "text": chunk_text,
+            "page": page_num,
+            "chunk_id": len(chunks)
+        })
+    
+    return chunks
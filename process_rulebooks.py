@@ -5,21 +5,34 @@ Run this script whenever you add new PDFs
 """
 
 import os
-import time
-from pypdf import PdfReader
+import re
+import requests
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import tiktoken
 import voyageai
 from dotenv import load_dotenv
-from database import init_database, game_exists, add_game, get_all_games, get_library_stats, file_already_processed
+from database import init_database, game_exists, add_game, get_all_games, get_library_stats, get_processed_filenames, save_game_index_files, load_game_index_files, enable_write_ahead_log, disable_write_ahead_log, close_connection
+from voyage_batch import RateLimiter, MAX_BATCH_SIZE, embed_cached
+from pdf_extract import extract_text_from_pdf, chunk_text
 
 # Load environment variables
 load_dotenv()
 
 # Configuration
 RULEBOOKS_FOLDER = "rulebooks"
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 50
-RATE_LIMIT_DELAY = 25  # Wait 25 seconds between API calls (free tier = 3 RPM)
+REQUESTS_PER_MINUTE = 3  # Voyage free tier limit (raise this after adding a payment method)
+TOKENS_PER_MINUTE = 10000  # Voyage free tier limit (raise this after adding a payment method)
+MAX_REQUEST_TOKENS = TOKENS_PER_MINUTE // REQUESTS_PER_MINUTE  # So a full minute of requests stays under the token limit
+EMBED_WORKERS = 4  # Batches allowed in flight at once (the rate limiter still spaces them out)
+GAME_WORKERS = 3  # Games processed side by side (all of them share one rate limiter)
+EMBEDDING_MODEL = "voyage-3"
+EMBEDDING_DIMENSIONS = 1024  # Length of a voyage-3 embedding
+
+# Filename keywords for each document type, checked in one pass over the name
+DOCUMENT_TYPE_RE = re.compile(r"faq|f\.a\.q|errata|rulebook|rules", re.IGNORECASE)
+DOCUMENT_TYPE_KEYWORDS = {"faq": "faq", "f.a.q": "faq", "errata": "errata", "rulebook": "rulebook", "rules": "rulebook"}
+DOCUMENT_TYPE_PRIORITY = ("faq", "errata", "rulebook")  # When a name matches several types
 
 def extract_game_title_from_filename(filename):
     """
@@ -32,8 +45,8 @@ def extract_game_title_from_filename(filename):
         Wingspan - FAQ.pdf → Wingspan
         catan.pdf → Catan
     """
-    # Remove .pdf extension
-    title = filename.replace('.pdf', '')
+    # Remove .pdf extension (any case)
+    title = os.path.splitext(filename)[0]
     
     # Handle different separator styles
     separators = [' - ', '-', '_']
@@ -56,101 +69,49 @@ def get_document_type(filename):
     
     Returns: 'rulebook', 'faq', 'errata', or 'supplement'
     """
-    filename_lower = filename.lower()
-    
-    if 'faq' in filename_lower or 'f.a.q' in filename_lower:
-        return 'faq'
-    elif 'errata' in filename_lower:
-        return 'errata'
-    elif 'rulebook' in filename_lower or 'rules' in filename_lower:
-        return 'rulebook'
-    else:
-        return 'supplement'
+    found = {DOCUMENT_TYPE_KEYWORDS[match.lower()] for match in DOCUMENT_TYPE_RE.findall(filename)}
+    
+    for doc_type in DOCUMENT_TYPE_PRIORITY:
+        if doc_type in found:
+            return doc_type
+    return 'supplement'
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF with page numbers"""
-    reader = PdfReader(pdf_path)
-    pages = []
-    for i, page in enumerate(reader.pages, start=1):
-        text = page.extract_text()
-        pages.append({"page": i, "text": text})
-    return pages
+@lru_cache(maxsize=None)
+def get_encoding():
+    """Tokenizer used for chunking, loaded once for every PDF in the run"""
+    return tiktoken.get_encoding("cl100k_base")
 
-def chunk_text(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Chunk text into segments"""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    chunks = []
-    
-    for page_data in pages:
-        page_num = page_data["page"]
-        text = page_data["text"]
-        tokens = encoding.encode(text)
-        
-        start = 0
-        while start < len(tokens):
-            end = start + chunk_size
-            chunk_tokens = tokens[start:end]
-            chunk_text = encoding.decode(chunk_tokens)
-            
-            chunks.append({
-                "text": chunk_text,
-                "page": page_num,
-                "chunk_id": len(chunks)
-            })
-            
-            start += (chunk_size - overlap)
-    
-    return chunks
+# Shared by every game being processed, since the limit is per API key
+embed_limiter = RateLimiter(REQUESTS_PER_MINUTE)
 
 def create_embeddings(chunks, voyage_client):
-    """Generate embeddings for chunks - FREE TIER VERSION with rate limiting"""
-    texts = [chunk["text"] for chunk in chunks]
-    
-    # Batch into groups of 10 to stay under rate limits
-    batch_size = 10
-    all_embeddings = []
-    
-    print(f"  Generating embeddings for {len(chunks)} chunks...")
-    print(f"  (Processing in batches of {batch_size}, ~{RATE_LIMIT_DELAY}s delay between batches)")
+    """
+    Generate embeddings for chunks - FREE TIER VERSION with rate limiting
     
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i+batch_size]
-        batch_num = (i // batch_size) + 1
-        total_batches = (len(texts) + batch_size - 1) // batch_size
-        
-        print(f"  Processing batch {batch_num}/{total_batches} ({len(batch)} chunks)...")
-        
-        try:
-            result = voyage_client.embed(texts=batch, model="voyage-3", input_type="document")
-            all_embeddings.extend(result.embeddings)
-            print(f"  ✅ Batch {batch_num} complete")
-            
-            # Wait between batches (except for the last one)
-            if i + batch_size < len(texts):
-                print(f"  ⏳ Waiting {RATE_LIMIT_DELAY} seconds (rate limit)...")
-                time.sleep(RATE_LIMIT_DELAY)
-        
-        except Exception as e:
-            print(f"  ❌ Error on batch {batch_num}: {e}")
-            print(f"  Retrying after {RATE_LIMIT_DELAY * 2} seconds...")
-            time.sleep(RATE_LIMIT_DELAY * 2)
-            
-            # Retry once
-            try:
-                result = voyage_client.embed(texts=batch, model="voyage-3", input_type="document")
-                all_embeddings.extend(result.embeddings)
-                print(f"  ✅ Retry successful")
-            except Exception as retry_error:
-                print(f"  ❌ Retry failed: {retry_error}")
-                raise
-    
-    # Add embeddings to chunks
-    for i, chunk in enumerate(chunks):
-        chunk["embedding"] = all_embeddings[i]
-    
-    return chunks
+    Returns (chunks, embeddings), where row i of the float32 embeddings
+    matrix belongs to chunks[i].
+    """
+    print(f"  (Batches of up to {MAX_BATCH_SIZE} chunks or {MAX_REQUEST_TOKENS} tokens, at most {REQUESTS_PER_MINUTE} requests per minute)")
+    
+    def report_batch(batch_num, total_batches, batch_size):
+        print(f"  ✅ Batch {batch_num}/{total_batches} complete ({batch_size} chunks)")
+    
+    # Reuses embeddings of text we've embedded in an earlier run
+    embeddings = embed_cached(
+        [chunk["text"] for chunk in chunks],
+        voyage_client,
+        get_encoding(),
+        model=EMBEDDING_MODEL,
+        limiter=embed_limiter,
+        workers=EMBED_WORKERS,
+        progress=report_batch,
+        log=print,
+        max_tokens=MAX_REQUEST_TOKENS
+    )
+    
+    return chunks, embeddings.reshape(len(chunks), EMBEDDING_DIMENSIONS)
 
-def process_pdf(pdf_path, voyage_client):
+def process_pdf(pdf_path, voyage_client, pdf_pool):
     """Process a single PDF file"""
     filename = os.path.basename(pdf_path)
     base_game_title = extract_game_title_from_filename(filename)
@@ -160,11 +121,6 @@ def process_pdf(pdf_path, voyage_client):
     print(f"   → Base game: {base_game_title}")
     print(f"   → Type: {doc_type}")
     
-    # Check if this exact file was already processed
-    if file_already_processed(filename):
-        print(f"  ⏭️  File already processed, skipping")
-        return False
-    
     # Check if base game exists
     existing_game = game_exists(base_game_title)
     if existing_game:
@@ -172,21 +128,23 @@ def process_pdf(pdf_path, voyage_client):
     
     # Extract text
     print(f"  📄 Extracting text...")
-    pages = extract_text_from_pdf(pdf_path)
+    with open(pdf_path, "rb") as f:
+        pages = extract_text_from_pdf(f.read(), pdf_pool)
     total_pages = len(pages)
     print(f"  ✅ Extracted {total_pages} pages")
     
     # Chunk text
     print(f"  ✂️  Chunking text...")
-    chunks = chunk_text(pages)
+    chunks = chunk_text(pages, get_encoding())
+    del pages  # The chunks hold all the text we need; don't keep the pages through the embed waits
     print(f"  ✅ Created {len(chunks)} chunks")
     
     # Generate embeddings
-    chunks_with_embeddings = create_embeddings(chunks, voyage_client)
+    chunks, embeddings = create_embeddings(chunks, voyage_client)
     
     # Store in database (merges with existing game if it exists)
     print(f"  💾 Storing in database...")
-    add_game(base_game_title, filename, total_pages, chunks_with_embeddings, source_type=doc_type)
+    add_game(base_game_title, filename, total_pages, chunks, source_type=doc_type, embeddings=embeddings)
     
     if existing_game:
         print(f"  ✅ Successfully added to existing game!")
@@ -195,6 +153,13 @@ def process_pdf(pdf_path, voyage_client):
     
     return True
 
+def process_game_pdfs(pdf_paths, voyage_client, pdf_pool):
+    """Process one game's PDFs in order on a worker thread; returns process_pdf's result for each"""
+    try:
+        return [process_pdf(pdf_path, voyage_client, pdf_pool) for pdf_path in pdf_paths]
+    finally:
+        close_connection()  # The worker thread's own connection
+
 def main():
     """Main processing function"""
     print("=" * 70)
@@ -208,6 +173,7 @@ def main():
     # Initialize database
     print("\n🔧 Initializing database...")
     init_database()
+    enable_write_ahead_log()  # Switched back before exiting, see below
     print("✅ Database ready")
     
     # Initialize Voyage client
@@ -217,6 +183,10 @@ def main():
         print("❌ ERROR: VOYAGE_API_KEY not found in .env file")
         return
     
+    # Every embed request reuses a pooled keep-alive connection instead of a new TLS handshake
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=EMBED_WORKERS * GAME_WORKERS))
+    voyageai.requestssession = session
     voyage_client = voyageai.Client(api_key=api_key)
     print("✅ Connected")
     
@@ -227,7 +197,8 @@ def main():
         return
     
     # Find all PDFs
-    pdf_files = [f for f in os.listdir(RULEBOOKS_FOLDER) if f.endswith('.pdf')]
+    with os.scandir(RULEBOOKS_FOLDER) as entries:
+        pdf_files = [entry for entry in entries if entry.is_file() and entry.name.lower().endswith('.pdf')]
     
     if not pdf_files:
         print(f"\n⚠️  No PDF files found in '{RULEBOOKS_FOLDER}' folder")
@@ -235,18 +206,34 @@ def main():
     
     print(f"\n📚 Found {len(pdf_files)} PDF file(s)")
     
-    # Process each PDF
-    processed_count = 0
+    # Skip files already in the library (one query for the whole folder)
+    processed_filenames = get_processed_filenames()
     skipped_count = 0
     
+    # Group files by game, so a game's rulebook and FAQ are added one after the other
+    game_pdfs = {}
     for pdf_file in pdf_files:
-        pdf_path = os.path.join(RULEBOOKS_FOLDER, pdf_file)
-        was_processed = process_pdf(pdf_path, voyage_client)
-        
-        if was_processed:
-            processed_count += 1
-        else:
+        if pdf_file.name in processed_filenames:
+            print(f"⏭️  {pdf_file.name} already processed, skipping")
             skipped_count += 1
+            continue
+        
+        game_title = extract_game_title_from_filename(pdf_file.name)
+        game_pdfs.setdefault(game_title, []).append(pdf_file.path)
+    
+    # Process games side by side - one game's PDF parsing overlaps another's
+    # wait for its next embed request slot
+    processed_count = 0
+    
+    # One set of text extraction processes for every PDF, started before the
+    # game threads so no worker is forked from a multithreaded process
+    with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as pdf_pool:
+        pdf_pool.submit(int).result()  # Launches the workers now rather than on first use
+        
+        with ThreadPoolExecutor(max_workers=GAME_WORKERS) as pool:
+            futures = [pool.submit(process_game_pdfs, pdf_paths, voyage_client, pdf_pool) for pdf_paths in game_pdfs.values()]
+            for future in futures:
+                processed_count += len(future.result())
     
     # Show summary
     print("\n" + "=" * 70)
@@ -255,6 +242,13 @@ def main():
     print(f"✅ Processed: {processed_count} new game(s)")
     print(f"⏭️  Skipped: {skipped_count} (already in library)")
     
+    # add_game keeps each game's memory-mapped search files current; this
+    # catches games processed before those files existed
+    for game in get_all_games():
+        if load_game_index_files(game['title']) is None:
+            print(f"🗂️  Writing search files for {game['title']}...")
+            save_game_index_files(game['title'])
+    
     # Show library stats
     stats = get_library_stats()
     print(f"\n📚 Library Statistics:")
@@ -273,4 +267,9 @@ def main():
     print()
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Leave a single self-contained game_library.db to commit (no -wal/-shm files)
+        disable_write_ahead_log()
+        close_connection()
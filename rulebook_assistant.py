@@ -5,11 +5,16 @@ Ingests PDF rulebooks and answers setup/rules questions with citations
 
 import streamlit as st
 import os
-from pypdf import PdfReader
+import hashlib
+import numpy as np
+import httpx
+import requests
 import tiktoken
 import chromadb
 from anthropic import Anthropic
 import voyageai
+from voyage_batch import embed_cached
+from pdf_extract import extract_text_from_pdf, chunk_text
 
 # Load environment variables from .env file if it exists
 try:
@@ -19,129 +24,131 @@ except ImportError:
     pass  # dotenv not installed, will use system env vars
 
 # Configuration
-CHUNK_SIZE = 500  # tokens
-CHUNK_OVERLAP = 50  # tokens
 TOP_K_RESULTS = 5  # number of chunks to retrieve
+QUESTION_EMBEDDING_CACHE_SIZE = 1024  # distinct questions whose embeddings are kept
+QUESTION_EMBEDDING_TTL = 3600  # seconds
+CHROMA_BATCH_SIZE = 5000  # rows per collection.add call (Chroma caps batch size)
+CHROMA_PATH = ".chroma"  # on-disk vector store, so processed rulebooks survive restarts
 
 # Initialize clients
 @st.cache_resource
 def init_clients():
-    """Initialize API clients"""
-    anthropic_client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+    """Initialize API clients over pooled keep-alive connections"""
+    # One pooled HTTP client for every Claude call, so TLS handshakes aren't repeated
+    http_client = httpx.Client(limits=httpx.Limits(max_keepalive_connections=20))
+    anthropic_client = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"), http_client=http_client)
+    
+    # The Voyage SDK uses requests; its session hook lets every call share one pool
+    session = requests.Session()
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=20))
+    voyageai.requestssession = session
+    # No SDK retries: voyage_batch retries embed requests itself, paced by its rate limiter
     voyage_client = voyageai.Client(api_key=os.environ.get("VOYAGE_API_KEY"))
-    chroma_client = chromadb.Client()
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
     return anthropic_client, voyage_client, chroma_client
 
-# PDF Processing Functions
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF with page numbers"""
-    reader = PdfReader(pdf_path)
-    pages = []
-    for i, page in enumerate(reader.pages, start=1):
-        text = page.extract_text()
-        pages.append({"page": i, "text": text})
-    return pages
-
-def chunk_text(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Chunk text into ~500 token segments with 50 token overlap"""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    chunks = []
-    
-    for page_data in pages:
-        page_num = page_data["page"]
-        text = page_data["text"]
-        
-        # Tokenize the page
-        tokens = encoding.encode(text)
-        
-        # Create overlapping chunks
-        start = 0
-        while start < len(tokens):
-            end = start + chunk_size
-            chunk_tokens = tokens[start:end]
-            chunk_text = encoding.decode(chunk_tokens)
-            
-            chunks.append({
-                "text": chunk_text,
-                "page": page_num,
-                "chunk_id": len(chunks)
-            })
-            
-            # Move forward by (chunk_size - overlap)
-            start += (chunk_size - overlap)
-    
-    return chunks
+@st.cache_resource
+def get_encoding():
+    """Tokenizer used for chunking, loaded once and shared across reruns"""
+    return tiktoken.get_encoding("cl100k_base")
 
+# PDF Processing Functions
 def create_embeddings(chunks, voyage_client):
     """Generate embeddings for all chunks"""
-    texts = [chunk["text"] for chunk in chunks]
+    # Embed each distinct text once - repeated boilerplate makes identical chunks
+    texts = list(dict.fromkeys(chunk["text"] for chunk in chunks))
     
-    # Voyage AI batch embedding
-    result = voyage_client.embed(
-        texts=texts,
-        model="voyage-3",
-        input_type="document"
-    )
-    
-    embeddings = result.embeddings
+    # Voyage AI batch embedding (split into requests the API accepts, with retries);
+    # text embedded before, even in an earlier session, comes from the local cache
+    embeddings = dict(zip(texts, embed_cached(texts, voyage_client, get_encoding(), model="voyage-3")))
     
     # Add embeddings to chunks
-    for i, chunk in enumerate(chunks):
-        chunk["embedding"] = embeddings[i]
+    for chunk in chunks:
+        chunk["embedding"] = embeddings[chunk["text"]]
     
     return chunks
 
-def store_in_chroma(chunks, collection_name, chroma_client):
-    """Store chunks in ChromaDB"""
-    # Create or get collection
+def get_collection_name(pdf_bytes):
+    """Collection name for a rulebook, derived from the file's contents"""
+    return "rulebook_" + hashlib.sha256(pdf_bytes).hexdigest()[:32]
+
+def get_stored_collection(collection_name, chroma_client):
+    """The collection stored for this rulebook by an earlier run, or None"""
     try:
         collection = chroma_client.get_collection(name=collection_name)
+    except Exception:
+        return None
+    
+    # A run that stopped partway through leaves a collection missing chunks
+    if collection.count() != (collection.metadata or {}).get("total_chunks"):
+        return None
+    return collection
+
+def store_in_chroma(chunks, collection_name, chroma_client, total_pages):
+    """Store chunks in ChromaDB"""
+    # Replace any incomplete collection left by an earlier run
+    try:
         chroma_client.delete_collection(name=collection_name)
-    except:
+    except Exception:
         pass
     
     collection = chroma_client.create_collection(
         name=collection_name,
-        metadata={"description": "Board game rulebook chunks"}
+        metadata={
+            "description": "Board game rulebook chunks",
+            "total_pages": total_pages,
+            "total_chunks": len(chunks)
+        }
     )
     
     # Prepare data for insertion
     ids = [f"chunk_{chunk['chunk_id']}" for chunk in chunks]
     documents = [chunk["text"] for chunk in chunks]
-    embeddings = [chunk["embedding"] for chunk in chunks]
+    embeddings = np.asarray([chunk["embedding"] for chunk in chunks], dtype=np.float32)
     metadatas = [{"page": chunk["page"]} for chunk in chunks]
     
-    # Add to collection
-    collection.add(
-        ids=ids,
-        documents=documents,
-        embeddings=embeddings,
-        metadatas=metadatas
-    )
+    # Add to collection in batches Chroma will accept
+    for start in range(0, len(ids), CHROMA_BATCH_SIZE):
+        stop = start + CHROMA_BATCH_SIZE
+        collection.add(
+            ids=ids[start:stop],
+            documents=documents[start:stop],
+            embeddings=embeddings[start:stop],
+            metadatas=metadatas[start:stop]
+        )
     
     return collection
 
 # Query Functions
-def query_rulebook(question, collection, voyage_client, anthropic_client, top_k=TOP_K_RESULTS):
-    """Query the rulebook and generate an answer"""
-    
-    # Embed the question
-    question_embedding = voyage_client.embed(
+# Leading underscore tells Streamlit not to hash the client into the cache key
+@st.cache_data(max_entries=QUESTION_EMBEDDING_CACHE_SIZE, ttl=QUESTION_EMBEDDING_TTL, show_spinner=False)
+def embed_question(question, _voyage_client):
+    """Embed a question, reusing the result when the same question is asked again"""
+    return _voyage_client.embed(
         texts=[question],
         model="voyage-3",
         input_type="query"
     ).embeddings[0]
+
+def query_rulebook(question, collection, voyage_client, anthropic_client, top_k=TOP_K_RESULTS):
+    """Query the rulebook and stream the answer into the page as it's generated"""
     
-    # Query ChromaDB
-    results = collection.query(
-        query_embeddings=[question_embedding],
-        n_results=top_k
-    )
+    with st.spinner("Searching rulebook..."):
+        # Embed the question
+        question_embedding = embed_question(question, voyage_client)
+        
+        # Query ChromaDB
+        results = collection.query(
+            query_embeddings=[question_embedding],
+            n_results=top_k
+        )
     
-    # Build context from retrieved chunks
+    # Build context from retrieved chunks, noting the source pages in the same pass
     context_parts = []
-    for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
+    pages_seen = set()
+    for doc, metadata in zip(results['documents'][0], results['metadatas'][0]):
         page = metadata['page']
+        pages_seen.add(page)
         context_parts.append(f"[Page {page}]\n{doc}")
     
     context = "\n\n---\n\n".join(context_parts)
@@ -160,16 +167,16 @@ USER QUESTION: {question}
 
 YOUR ANSWER:"""
 
-    message = anthropic_client.messages.create(
+    # Render tokens as they arrive rather than after the whole answer is done
+    with anthropic_client.messages.stream(
         model="claude-sonnet-4-20250514",
         max_tokens=1000,
         messages=[{"role": "user", "content": prompt}]
-    )
-    
-    answer = message.content[0].text
+    ) as stream:
+        answer = st.write_stream(stream.text_stream)
     
     # Also return the source pages for transparency
-    source_pages = sorted(set([m['page'] for m in results['metadatas'][0]]))
+    source_pages = sorted(pages_seen)
     
     return answer, source_pages
 
@@ -196,31 +203,36 @@ def main():
         if uploaded_file is not None:
             st.success(f"Loaded: {uploaded_file.name}")
             
-            # Save the uploaded file temporarily
-            pdf_path = f"/tmp/{uploaded_file.name}"
-            with open(pdf_path, "wb") as f:
-                f.write(uploaded_file.read())
+            # Parsed straight from memory; nothing is written to disk
+            pdf_bytes = uploaded_file.getvalue()
             
             # Process button
             if st.button("🔄 Process Rulebook", type="primary"):
-                with st.spinner("Extracting text from PDF..."):
-                    pages = extract_text_from_pdf(pdf_path)
-                    st.session_state['total_pages'] = len(pages)
+                # The same rulebook processed before (even before a restart) is reused as-is
+                collection_name = get_collection_name(pdf_bytes)
+                collection = get_stored_collection(collection_name, chroma_client)
                 
-                with st.spinner("Chunking text..."):
-                    chunks = chunk_text(pages)
-                    st.session_state['total_chunks'] = len(chunks)
+                if collection is None:
+                    with st.spinner("Extracting text from PDF..."):
+                        pages = extract_text_from_pdf(pdf_bytes)
+                    
+                    with st.spinner("Chunking text..."):
+                        chunks = chunk_text(pages, get_encoding())
+                    
+                    with st.spinner("Generating embeddings..."):
+                        chunks_with_embeddings = create_embeddings(chunks, voyage_client)
+                    
+                    with st.spinner("Storing in vector database..."):
+                        collection = store_in_chroma(
+                            chunks_with_embeddings,
+                            collection_name,
+                            chroma_client,
+                            len(pages)
+                        )
                 
-                with st.spinner("Generating embeddings..."):
-                    chunks_with_embeddings = create_embeddings(chunks, voyage_client)
-                
-                with st.spinner("Storing in vector database..."):
-                    collection = store_in_chroma(
-                        chunks_with_embeddings,
-                        "rulebook_collection",
-                        chroma_client
-                    )
-                    st.session_state['collection'] = collection
+                st.session_state['collection'] = collection
+                st.session_state['total_pages'] = collection.metadata["total_pages"]
+                st.session_state['total_chunks'] = collection.metadata["total_chunks"]
                 
                 st.success("✅ Rulebook processed successfully!")
                 st.info(f"📄 {st.session_state['total_pages']} pages → {st.session_state['total_chunks']} chunks")
@@ -255,17 +267,14 @@ def main():
         )
         
         if st.button("🔍 Get Answer", type="primary") and question:
-            with st.spinner("Searching rulebook..."):
-                answer, source_pages = query_rulebook(
-                    question,
-                    st.session_state['collection'],
-                    voyage_client,
-                    anthropic_client
-                )
-            
-            # Display answer
+            # Display answer (streamed in as it's generated)
             st.markdown("### Answer")
-            st.markdown(answer)
+            answer, source_pages = query_rulebook(
+                question,
+                st.session_state['collection'],
+                voyage_client,
+                anthropic_client
+            )
             
             # Display sources
             st.markdown(f"**📖 Sources:** Pages {', '.join(map(str, source_pages))}")
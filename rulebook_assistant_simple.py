@@ -5,12 +5,15 @@ Works on Windows without C++ compilation
 
 import streamlit as st
 import os
+import json
+import hashlib
 import numpy as np
-from pypdf import PdfReader
+from collections import Counter
 import tiktoken
 from anthropic import Anthropic
 import voyageai
-import pickle
+from voyage_batch import embed_cached
+from pdf_extract import extract_text_from_pdf, chunk_text
 
 # Load environment variables from .env file if it exists
 try:
@@ -19,10 +22,24 @@ try:
 except ImportError:
     pass
 
+try:
+    import faiss
+except ImportError:
+    faiss = None  # faiss not installed, search with simsimd or NumPy instead
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None  # simsimd not installed, score with NumPy instead
+
 # Configuration
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 50
 TOP_K_RESULTS = 5
+FAISS_HNSW_MIN_CHUNKS = 10000  # Switch from exact to approximate FAISS search above this
+EMBED_WORKERS = 4  # Embed requests in flight at once
+MIN_PAGE_TOKENS = 20  # Pages with less text than this (covers, blank backs) aren't chunked
+EDGE_LINES = 3  # Lines at the top and bottom of each page checked for running headers/footers
+REPEATED_LINE_MIN_PAGES = 3  # An edge line on this many pages (and half of them) is boilerplate
+PROCESSED_FOLDER = ".processed_rulebooks"  # Processed uploads, one folder per PDF content hash
 
 # Initialize clients
 @st.cache_resource
@@ -32,89 +49,134 @@ def init_clients():
     voyage_client = voyageai.Client(api_key=os.environ.get("VOYAGE_API_KEY"))
     return anthropic_client, voyage_client
 
+@st.cache_resource
+def get_encoding():
+    """Tokenizer used for chunking, loaded once and shared across reruns"""
+    return tiktoken.get_encoding("cl100k_base")
+
 # PDF Processing
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF with page numbers"""
-    reader = PdfReader(pdf_path)
-    pages = []
-    for i, page in enumerate(reader.pages, start=1):
-        text = page.extract_text()
-        pages.append({"page": i, "text": text})
-    return pages
-
-def chunk_text(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    """Chunk text into segments"""
-    encoding = tiktoken.get_encoding("cl100k_base")
-    chunks = []
-    
-    for page_data in pages:
-        page_num = page_data["page"]
-        text = page_data["text"]
-        tokens = encoding.encode(text)
-        
-        start = 0
-        while start < len(tokens):
-            end = start + chunk_size
-            chunk_tokens = tokens[start:end]
-            chunk_text = encoding.decode(chunk_tokens)
-            
-            chunks.append({
-                "text": chunk_text,
-                "page": page_num,
-                "chunk_id": len(chunks)
-            })
-            
-            start += (chunk_size - overlap)
+def clean_pages(pages):
+    """Drop blank pages, then running headers and footers (edge lines repeated across many pages)"""
+    pages = [page_data for page_data in pages if page_data["text"] and page_data["text"].strip()]
+    page_lines = [page_data["text"].splitlines() for page_data in pages]
     
-    return chunks
-
-def create_embeddings(chunks, voyage_client):
-    """Generate embeddings for chunks"""
-    texts = [chunk["text"] for chunk in chunks]
-    result = voyage_client.embed(texts=texts, model="voyage-3", input_type="document")
-    embeddings = result.embeddings
+    # Count each distinct line once per page, looking only near the top and bottom
+    counts = Counter()
+    for lines in page_lines:
+        edges = lines[:EDGE_LINES] + lines[-EDGE_LINES:]
+        counts.update({line.strip() for line in edges if line.strip()})
     
-    for i, chunk in enumerate(chunks):
-        chunk["embedding"] = embeddings[i]
+    min_pages = max(REPEATED_LINE_MIN_PAGES, len(pages) // 2)
+    repeated = {line for line, count in counts.items() if count >= min_pages}
+    if not repeated:
+        return pages
     
-    return chunks
+    stripped = []
+    for page_data, lines in zip(pages, page_lines):
+        keep = [
+            line for i, line in enumerate(lines)
+            if not (line.strip() in repeated and (i < EDGE_LINES or i >= len(lines) - EDGE_LINES))
+        ]
+        stripped.append({"page": page_data["page"], "text": "\n".join(keep)})
+    return stripped
 
-def cosine_similarity(vec1, vec2):
-    """Calculate cosine similarity between two vectors"""
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+def normalize(vectors):
+    """L2-normalize a vector, or each row of a matrix, as float32 so dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
 
-def search_chunks(query_embedding, chunks, top_k=TOP_K_RESULTS):
-    """Search for most similar chunks"""
-    similarities = []
-    for chunk in chunks:
-        sim = cosine_similarity(query_embedding, chunk["embedding"])
-        similarities.append((sim, chunk))
+def create_embeddings(texts, voyage_client):
+    """Generate embeddings for chunk texts; row i of the normalized float32 matrix belongs to texts[i]"""
+    # Token-aware batches the API accepts, sent a few at a time (with retries);
+    # text embedded before, even in an earlier session, comes from the local cache
+    embeddings = embed_cached(
+        texts,
+        voyage_client,
+        get_encoding(),
+        model="voyage-3",
+        workers=EMBED_WORKERS
+    )
+    return normalize(embeddings)
+
+def build_faiss_index(embeddings):
+    """FAISS index over the normalized embeddings, or None if faiss isn't installed"""
+    if faiss is None:
+        return None
     
-    # Sort by similarity (highest first)
-    similarities.sort(reverse=True, key=lambda x: x[0])
+    # Inner product on unit vectors is cosine similarity
+    dimensions = embeddings.shape[1]
+    if len(embeddings) >= FAISS_HNSW_MIN_CHUNKS:
+        index = faiss.IndexHNSWFlat(dimensions, 32, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(dimensions)
+    index.add(embeddings)
+    return index
+
+def build_index(texts, pages, embeddings):
+    """
+    Everything search needs for one rulebook, as parallel columns (row i is chunk i)
     
-    # Return top K
-    return [chunk for _, chunk in similarities[:top_k]]
+    - texts, pages: chunk text and page number
+    - embeddings: normalized float32 matrix
+    - faiss: FAISS index over the embeddings (None if faiss isn't installed)
+    """
+    return {
+        "texts": texts,
+        "pages": pages,
+        "embeddings": embeddings,
+        "faiss": build_faiss_index(embeddings)
+    }
 
-def query_rulebook(question, chunks, voyage_client, anthropic_client, top_k=TOP_K_RESULTS):
-    """Query rulebook and generate answer"""
+def search_chunks(query_embedding, index, top_k=TOP_K_RESULTS):
+    """Search for most similar chunks"""
+    # Chunk embeddings are normalized at ingest; normalize the query once here,
+    # so every kernel below is a plain dot product with no per-chunk norms
+    query = normalize(query_embedding)
     
-    # Embed the question
-    question_embedding = voyage_client.embed(
-        texts=[question],
-        model="voyage-3",
-        input_type="query"
-    ).embeddings[0]
+    if index["faiss"] is not None:
+        _, idx = index["faiss"].search(query[np.newaxis, :], top_k)
+        idx = idx[0][idx[0] >= 0]
+    else:
+        if simsimd is not None:
+            # Hand-tuned SIMD float32 cosine kernel for the CPU we're running on (cosine
+            # distance means the same thing in every simsimd release; "inner" doesn't)
+            distances = simsimd.cdist(query[np.newaxis, :], index["embeddings"], metric="cosine")
+            similarities = 1 - np.asarray(distances)[0]
+        else:
+            # Cosine similarity against every chunk in one matrix-vector product
+            similarities = index["embeddings"] @ query
+        
+        # Partial selection of the top K, then sort only those (highest first)
+        k = min(top_k, len(similarities))
+        if k == 0:
+            return []
+        idx = np.argpartition(-similarities, k - 1)[:k]
+        idx = idx[np.argsort(-similarities[idx])]
+    
+    # Only the winning rows are turned into chunk dicts
+    return [{"text": index["texts"][i], "page": index["pages"][i]} for i in map(int, idx)]
+
+def query_rulebook(question, index, voyage_client, anthropic_client, top_k=TOP_K_RESULTS):
+    """Query rulebook and stream the answer into the page as it's generated"""
     
-    # Search for similar chunks
-    top_chunks = search_chunks(question_embedding, chunks, top_k)
+    with st.spinner("Searching rulebook..."):
+        # Embed the question
+        question_embedding = voyage_client.embed(
+            texts=[question],
+            model="voyage-3",
+            input_type="query"
+        ).embeddings[0]
+        
+        # Search for similar chunks
+        top_chunks = search_chunks(question_embedding, index, top_k)
     
-    # Build context
+    # Build context, noting the source pages in the same pass
     context_parts = []
+    pages_seen = set()
     for chunk in top_chunks:
         page = chunk['page']
+        pages_seen.add(page)
         context_parts.append(f"[Page {page}]\n{chunk['text']}")
     
     context = "\n\n---\n\n".join(context_parts)
@@ -133,17 +195,52 @@ USER QUESTION: {question}
 
 YOUR ANSWER:"""
 
-    message = anthropic_client.messages.create(
+    # Render tokens as they arrive rather than after the whole answer is done
+    with anthropic_client.messages.stream(
         model="claude-sonnet-4-20250514",
         max_tokens=1000,
         messages=[{"role": "user", "content": prompt}]
-    )
+    ) as stream:
+        answer = st.write_stream(stream.text_stream)
     
-    answer = message.content[0].text
-    source_pages = sorted(set([chunk['page'] for chunk in top_chunks]))
+    source_pages = sorted(pages_seen)
     
     return answer, source_pages
 
+# Processed rulebook storage
+def get_processed_paths(pdf_hash):
+    """Paths of a processed rulebook's embedding matrix (.npy) and chunk metadata (.json)"""
+    folder = os.path.join(PROCESSED_FOLDER, pdf_hash)
+    return os.path.join(folder, "embeddings.npy"), os.path.join(folder, "meta.json")
+
+def save_processed_rulebook(pdf_hash, total_pages, texts, pages, embeddings):
+    """Store a processed rulebook so the same PDF never has to be processed again"""
+    matrix_path, meta_path = get_processed_paths(pdf_hash)
+    os.makedirs(os.path.dirname(matrix_path), exist_ok=True)
+    np.save(matrix_path, embeddings)
+    
+    # Written last, so a folder with meta.json holds a complete rulebook
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"total_pages": total_pages, "texts": texts, "pages": pages}, f)
+
+def load_processed_rulebook(pdf_hash):
+    """
+    Load a stored rulebook as (total_pages, texts, pages, embeddings), memory-mapping
+    the embeddings, or None if this PDF hasn't been processed before
+    """
+    matrix_path, meta_path = get_processed_paths(pdf_hash)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        embeddings = np.load(matrix_path, mmap_mode="r")
+        texts, pages = meta["texts"], meta["pages"]
+    except (OSError, ValueError, KeyError):
+        return None
+    
+    if not len(embeddings) == len(texts) == len(pages):
+        return None
+    return meta["total_pages"], texts, pages, embeddings
+
 # Streamlit UI
 def main():
     st.set_page_config(page_title="Rulebook Assistant", page_icon="🎲", layout="wide")
@@ -167,24 +264,39 @@ def main():
         if uploaded_file is not None:
             st.success(f"Loaded: {uploaded_file.name}")
             
-            # Save temporarily
-            pdf_path = f"/tmp/{uploaded_file.name}"
-            with open(pdf_path, "wb") as f:
-                f.write(uploaded_file.read())
+            # Parsed straight from memory; nothing is written to disk
+            pdf_bytes = uploaded_file.getvalue()
             
             # Process button
             if st.button("🔄 Process Rulebook", type="primary"):
-                with st.spinner("Extracting text from PDF..."):
-                    pages = extract_text_from_pdf(pdf_path)
-                    st.session_state['total_pages'] = len(pages)
+                # The same PDF processed before (even in an earlier session) is loaded as-is
+                pdf_hash = hashlib.sha256(pdf_bytes).hexdigest()
+                processed = load_processed_rulebook(pdf_hash)
                 
-                with st.spinner("Chunking text..."):
-                    chunks = chunk_text(pages)
-                    st.session_state['total_chunks'] = len(chunks)
+                if processed is None:
+                    with st.spinner("Extracting text from PDF..."):
+                        pages = extract_text_from_pdf(pdf_bytes)
+                        total_pages = len(pages)
+                    
+                    with st.spinner("Chunking text..."):
+                        chunks = chunk_text(clean_pages(pages), get_encoding(), min_page_tokens=MIN_PAGE_TOKENS)
+                        texts = [chunk["text"] for chunk in chunks]
+                        chunk_pages = [chunk["page"] for chunk in chunks]
+                    
+                    if not texts:
+                        st.error("❌ No readable text found in this PDF (is it a scan?)")
+                        st.stop()
+                    
+                    with st.spinner("Generating embeddings..."):
+                        embeddings = create_embeddings(texts, voyage_client)
+                    
+                    save_processed_rulebook(pdf_hash, total_pages, texts, chunk_pages, embeddings)
+                    processed = (total_pages, texts, chunk_pages, embeddings)
                 
-                with st.spinner("Generating embeddings..."):
-                    chunks_with_embeddings = create_embeddings(chunks, voyage_client)
-                    st.session_state['chunks'] = chunks_with_embeddings
+                total_pages, texts, chunk_pages, embeddings = processed
+                st.session_state['total_pages'] = total_pages
+                st.session_state['total_chunks'] = len(texts)
+                st.session_state['index'] = build_index(texts, chunk_pages, embeddings)
                 
                 st.success("✅ Rulebook processed successfully!")
                 st.info(f"📄 {st.session_state['total_pages']} pages → {st.session_state['total_chunks']} chunks")
@@ -196,7 +308,7 @@ def main():
             st.metric("Chunks", st.session_state['total_chunks'])
     
     # Main Q&A area
-    if 'chunks' not in st.session_state:
+    if 'index' not in st.session_state:
         st.info("👈 Upload and process a rulebook to get started!")
     else:
         st.header("💬 Ask a Question")
@@ -219,17 +331,14 @@ def main():
         )
         
         if st.button("🔍 Get Answer", type="primary") and question:
-            with st.spinner("Searching rulebook..."):
-                answer, source_pages = query_rulebook(
-                    question,
-                    st.session_state['chunks'],
-                    voyage_client,
-                    anthropic_client
-                )
-            
-            # Display answer
+            # Display answer (streamed in as it's generated)
             st.markdown("### Answer")
-            st.markdown(answer)
+            answer, source_pages = query_rulebook(
+                question,
+                st.session_state['index'],
+                voyage_client,
+                anthropic_client
+            )
             
             # Display sources
             st.markdown(f"**📖 Sources:** Pages {', '.join(map(str, source_pages))}")
@@ -0,0 +1,165 @@
+"""
+Batched, rate-limited Voyage AI embedding with retries
+Shared by process_rulebooks.py and rulebook_assistant.py
+"""
+
+import time
+import threading
+import numpy as np
+import voyageai
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from database import embedding_cache_key, get_cached_embeddings, cache_embeddings
+
+# Configuration
+MAX_BATCH_SIZE = 128  # Most texts Voyage accepts in one embed request
+MAX_BATCH_TOKENS = 100000  # Voyage allows 120K tokens per request; cl100k counts are only approximate (paid keys)
+RETRY_DELAY = 50  # Seconds before the first retry; doubles (with jitter) after each failure
+MAX_RETRY_DELAY = 300  # Longest wait between retries, in seconds
+MAX_ATTEMPTS = 5  # Tries per batch before giving up
+
+# Failures worth waiting out - bad requests and bad keys fail straight away
+RETRYABLE_ERRORS = (
+    voyageai.error.RateLimitError,
+    voyageai.error.ServiceUnavailableError,
+    voyageai.error.ServerError,
+    voyageai.error.Timeout,
+    voyageai.error.APIConnectionError,
+    voyageai.error.TryAgain
+)
+
+class RateLimiter:
+    """
+    Token bucket shared by worker threads: at most `rate` requests per `per` seconds
+    
+    With the default burst of 1 requests are evenly spaced, so no 60 second
+    window ever sees more than `rate` of them.
+    """
+    
+    def __init__(self, rate, per=60.0, burst=1):
+        self.interval = per / rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.interval
+            time.sleep(wait)
+
+def make_batches(texts, encoding, max_size=MAX_BATCH_SIZE, max_tokens=MAX_BATCH_TOKENS):
+    """Group texts, in order, into as few embed requests as the API limits allow"""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    
+    for text, tokens in zip(texts, encoding.encode_ordinary_batch(texts)):
+        if batch and (len(batch) == max_size or batch_tokens + len(tokens) > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(text)
+        batch_tokens += len(tokens)
+    
+    if batch:
+        batches.append(batch)
+    return batches
+
+backoff = wait_exponential_jitter(initial=RETRY_DELAY, max=MAX_RETRY_DELAY)
+
+def retry_wait(retry_state):
+    """Wait as long as a rate-limited response's Retry-After asks, otherwise back off exponentially"""
+    headers = getattr(retry_state.outcome.exception(), "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after") or headers.get("Retry-After")), MAX_RETRY_DELAY)
+    except (TypeError, ValueError):
+        return backoff(retry_state)  # No header, or an HTTP date rather than seconds
+
+def report_retry(retry_state):
+    """Log a failed embed request before waiting to retry it, through the call's `log` if it has one"""
+    log = retry_state.kwargs.get("log")
+    if log is not None:
+        log(f"  ❌ Embed request failed: {retry_state.outcome.exception()}")
+        log(f"  Retrying after {retry_state.next_action.sleep:.0f} seconds...")
+
+@retry(
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=retry_wait,
+    stop=stop_after_attempt(MAX_ATTEMPTS),
+    before_sleep=report_retry,
+    reraise=True
+)
+def embed_batch(texts, voyage_client, model, input_type, limiter=None, log=None):
+    """Embed one batch of texts; every attempt waits for its own rate limit slot"""
+    if limiter is not None:
+        limiter.acquire()
+    return voyage_client.embed(texts=texts, model=model, input_type=input_type).embeddings
+
+def embed_many(texts, voyage_client, encoding, model="voyage-3", input_type="document", limiter=None, workers=1, progress=None, max_tokens=MAX_BATCH_TOKENS, log=None):
+    """
+    Embed any number of texts in as few requests as possible
+    
+    Returns a float32 matrix whose row i is the embedding of texts[i].
+    `progress`, if given, is called as progress(batch_num, total_batches, batch_size)
+    as each batch completes, and `log`, if given, with a message about each retry.
+    `max_tokens` caps each request; keys with a tokens-per-minute limit need
+    it well below the API's own maximum.
+    """
+    batches = make_batches(texts, encoding, max_tokens=max_tokens)
+    if not batches:
+        return np.empty((0, 0), dtype=np.float32)
+    
+    def run_batch(batch_num, batch):
+        embeddings = embed_batch(batch, voyage_client, model, input_type, limiter, log=log)
+        if progress is not None:
+            progress(batch_num, len(batches), len(batch))
+        return embeddings
+    
+    # The limiter paces requests, so a slow response doesn't hold up the next slot
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_batch, n, batch) for n, batch in enumerate(batches, start=1)]
+        try:
+            return np.concatenate([np.asarray(future.result(), dtype=np.float32) for future in futures])
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+def embed_cached(texts, voyage_client, encoding, model="voyage-3", input_type="document", log=None, **kwargs):
+    """
+    embed_many, but only for texts the local embedding cache doesn't already have
+    
+    Cache keys hash the model, input type and text, so identical texts (repeated
+    boilerplate, or the same rulebook uploaded again) are embedded once.
+    `log`, if given, is called with each progress or retry message (e.g. print).
+    Other keyword arguments are passed on to embed_many.
+    """
+    keys = [embedding_cache_key(model, input_type, text) for text in texts]
+    cached = get_cached_embeddings(keys)
+    
+    to_embed = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            to_embed.setdefault(key, text)
+    
+    if log is not None:
+        if cached:
+            log(f"  ♻️  Reusing {sum(key in cached for key in keys)} cached embeddings")
+        log(f"  Generating embeddings for {len(to_embed)} chunks...")
+    
+    new_rows = dict(zip(to_embed, embed_many(list(to_embed.values()), voyage_client, encoding, model=model, input_type=input_type, log=log, **kwargs)))
+    cache_embeddings(new_rows)
+    cached.update(new_rows)
+    
+    if not keys:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([cached[key] for key in keys])